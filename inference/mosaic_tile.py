@@ -10,6 +10,7 @@ parser.add_argument("--output_dir", type=str, required=True, help="Directory to
 parser.add_argument("--blend", type=str, default="hann", help="Blend mode: average, smooth, hann")
 parser.add_argument("--dtype", type=str, default="uint16", help="Output data type: uint16 or uint8")
 parser.add_argument("--mask", type=str, default=None, help="Optional mask raster to apply")
+parser.add_argument("--workers", type=int, default=None, help="Number of blending threads (default: all CPUs)")
 args = parser.parse_args()
 
 # --- Load patch list for this tile ---
@@ -31,7 +32,8 @@ blend_patches_to_raster(
     patch_files=patch_files,
     blend=args.blend,
     dtype=args.dtype,
-    mask_file=args.mask  # Pass the mask argument
+    mask_file=args.mask,  # Pass the mask argument
+    n_workers=args.workers,
 )
 
 print(f"Tile {args.part} done: {output_path}")
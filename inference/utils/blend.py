@@ -1,32 +1,156 @@
 import rasterio
 import numpy as np
 import os
-from rasterio.warp import reproject, Resampling
+import functools
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.vrt import WarpedVRT
 from rasterio.transform import from_origin
-from rasterio.windows import Window 
+from rasterio.windows import Window, transform as window_transform
 from tqdm import tqdm
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
+# GDAL settings for blending: keep block cache and file handles warm
+# across the many patch opens. GDAL_NUM_THREADS is deliberately not set
+# here: block tasks already run in parallel, only the writer gets it.
+_GDAL_ENV = {
+    'GDAL_CACHEMAX': 2048,
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'VSI_CACHE': True,
+    'VSI_CACHE_SIZE': 1000000000,
+    'CPL_VSIL_CURL_CACHE_SIZE': 200000000,
+}
+
+# weight used for 'average' blending; broadcasts against any patch shape
+_UNIT_WEIGHT = 1.0
+
+
+@functools.lru_cache(maxsize=8)
 def _distance_weight(h, w):
     """
     Generate a smooth linear distance-to-edge weight map.
     Weight = min distance to edge / (half of min dimension)
     """
-    yy, xx = np.mgrid[0:h, 0:w]
-    dist_y = np.minimum(yy, h - 1 - yy)
-    dist_x = np.minimum(xx, w - 1 - xx)
-    dist = np.minimum(dist_y, dist_x)
-    norm = np.maximum(dist / (0.5 * min(h, w)), 0)
-    return norm.astype(np.float16)
+    yy = np.arange(h)
+    xx = np.arange(w)
+    dist_y = np.minimum(yy, h - 1 - yy).astype(np.float32)
+    dist_x = np.minimum(xx, w - 1 - xx).astype(np.float32)
+    dist = np.minimum(dist_y[:, None], dist_x[None, :])
+    norm = np.maximum(dist / (0.5 * min(h, w)), 0).astype(np.float32, copy=False)
+    norm.setflags(write=False)
+    return norm
 
 
+@functools.lru_cache(maxsize=8)
 def _hann_weight(h, w):
     """
     Generate a 2D Hann (cosine) weight map.
     """
     wy = np.hanning(h)
     wx = np.hanning(w)
-    return np.outer(wy, wx).astype(np.float16)
+    weight = np.outer(wy, wx).astype(np.float32)
+    weight.setflags(write=False)
+    return weight
+
+
+def _get_weight(h, w, blend):
+    """
+    Return the (cached, read-only) weight kernel for a patch shape.
+    """
+    if blend == "average":
+        return _UNIT_WEIGHT
+    elif blend == "smooth":
+        return _distance_weight(h, w)
+    elif blend == "hann":
+        return _hann_weight(h, w)
+    raise ValueError("blend must be 'average', 'smooth', or 'hann'")
+
+def _blend_block(win, patch_files, patch_windows, patch_aligned, blend, vrt_options):
+    """
+    Accumulate all patches overlapping one output window and return
+    the normalized float32 block. Patches on the output grid are read
+    directly; others go through a WarpedVRT described by vrt_options.
+    """
+    b_row, b_col = win.row_off, win.col_off
+    bh, bw = win.height, win.width
+    acc = np.zeros((bh, bw), dtype=np.float32)
+    weight_sum = np.zeros((bh, bw), dtype=np.float32)
+
+    # patches intersecting this block
+    rows, cols, hs, ws = patch_windows.T
+    hits = np.nonzero(
+        (rows < b_row + bh) & (rows + hs > b_row) &
+        (cols < b_col + bw) & (cols + ws > b_col)
+    )[0]
+
+    # reusable read buffer; flat so every (h, w) view stays contiguous
+    buf = np.empty(bh * bw, dtype=np.float32)
+
+    for i in hits:
+        row_off, col_off, h, w = (int(v) for v in patch_windows[i])
+
+        # overlap in output pixel coords
+        r0, r1 = max(row_off, b_row), min(row_off + h, b_row + bh)
+        c0, c1 = max(col_off, b_col), min(col_off + w, b_col + bw)
+
+        # read straight into float32, GDAL does the cast
+        data = buf[:(r1 - r0) * (c1 - c0)].reshape(r1 - r0, c1 - c0)
+        valid = None
+        with rasterio.open(patch_files[i]) as src:
+            if patch_aligned[i]:
+                src.read(
+                    1, window=Window(c0 - col_off, r0 - row_off, c1 - c0, r1 - r0),
+                    out=data,
+                )
+            else:
+                # warp onto the output grid; the alpha band marks pixels the
+                # patch actually covers inside its bounding box
+                with WarpedVRT(src, **vrt_options) as vrt:
+                    vrt_window = Window(c0, r0, c1 - c0, r1 - r0)
+                    vrt.read(1, window=vrt_window, out=data)
+                    valid = vrt.read_masks(1, window=vrt_window) > 0
+
+        acc_slice = acc[r0 - b_row:r1 - b_row, c0 - b_col:c1 - b_col]
+        ws_slice = weight_sum[r0 - b_row:r1 - b_row, c0 - b_col:c1 - b_col]
+
+        weight = _get_weight(h, w, blend)
+        if blend != "average":
+            weight = weight[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off]
+
+        if valid is not None:
+            # uncovered bbox corners get no weight
+            weight = np.multiply(weight, valid, dtype=np.float32)
+        elif blend == "average":
+            # unit weight: plain sum and count, no kernel pass
+            np.add(acc_slice, data, out=acc_slice)
+            np.add(ws_slice, weight, out=ws_slice)
+            continue
+
+        np.multiply(data, weight, out=data)
+        np.add(acc_slice, data, out=acc_slice)
+        np.add(ws_slice, weight, out=ws_slice)
+
+    # normalize in place; acc is already 0 wherever weight_sum is 0
+    np.divide(acc, weight_sum, out=acc, where=(weight_sum > 0))
+    return acc
+
+def _mask_block(win, mask_file, transform, crs):
+    """
+    Reproject the mask raster (nearest) onto one output window.
+    """
+    block_mask = np.zeros((win.height, win.width), dtype=np.uint8)
+    with rasterio.open(mask_file) as mask_src:
+        reproject(
+            source=rasterio.band(mask_src, 1),
+            destination=block_mask,
+            src_transform=mask_src.transform,
+            src_crs=mask_src.crs,
+            dst_transform=window_transform(win, transform),
+            dst_crs=crs,
+            resampling=Resampling.nearest,
+        )
+    return block_mask
 
 def blend_patches_to_raster(
     output_path,
@@ -35,6 +159,7 @@ def blend_patches_to_raster(
     blend="average",
     dtype="uint16",
     mask_file=None,
+    n_workers=None,
 ):
     """
     Blend overlapping patch GeoTIFFs into one raster.
@@ -47,6 +172,7 @@ def blend_patches_to_raster(
     - blend: 'average', 'smooth', or 'hann'
     - dtype: 'uint16' or 'uint8'
     - mask_file: optional path to a mask raster; 1=keep, 0=mask out
+    - n_workers: number of threads blending output blocks (default: all CPUs)
     """
 
     if patch_files is None:
@@ -61,22 +187,32 @@ def blend_patches_to_raster(
     if not patch_files:
         raise FileNotFoundError("No patches found")
 
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # collect patch metadata in a single pass
+    patch_meta = []
+    with rasterio.Env(**_GDAL_ENV):
+        for pf in patch_files:
+            with rasterio.open(pf) as src:
+                patch_meta.append((src.crs, src.transform, src.bounds))
+
     # reference metadata
-    with rasterio.open(patch_files[0]) as ref:
-        crs = ref.crs
-        transform_ref = ref.transform
-        pixel_size_x = transform_ref.a
-        pixel_size_y = -transform_ref.e
+    crs, transform_ref = patch_meta[0][:2]
+    pixel_size_x = transform_ref.a
+    pixel_size_y = -transform_ref.e
+
+    # patch bounds in the reference crs
+    patch_bounds = [
+        tuple(bounds) if patch_crs == crs else transform_bounds(patch_crs, crs, *bounds)
+        for patch_crs, _, bounds in patch_meta
+    ]
 
     # define output bounds
-    minx = miny = maxx = maxy = None
-    for pf in patch_files:
-        with rasterio.open(pf) as src:
-            left, bottom, right, top = src.bounds
-            minx = left if minx is None else min(minx, left)
-            miny = bottom if miny is None else min(miny, bottom)
-            maxx = right if maxx is None else max(maxx, right)
-            maxy = top if maxy is None else max(maxy, top)
+    minx = min(b[0] for b in patch_bounds)
+    miny = min(b[1] for b in patch_bounds)
+    maxx = max(b[2] for b in patch_bounds)
+    maxy = max(b[3] for b in patch_bounds)
 
     width = int(np.ceil((maxx - minx) / pixel_size_x))
     height = int(np.ceil((maxy - miny) / pixel_size_y))
@@ -84,58 +220,50 @@ def blend_patches_to_raster(
 
     print(f"Output raster size: {width} × {height}")
 
-    # initialize acummulator
-    acc = np.zeros((height, width), dtype=np.float32)
-    weight_sum = np.zeros((height, width), dtype=np.float32)
-
-    # process each patch
-    for pf in tqdm(patch_files, desc=f"Blending ({blend})"):
-        with rasterio.open(pf) as src:
-            data = src.read(1).astype(np.float32)
-            h, w = data.shape
-
-            if blend == "average":
-                weight = np.ones((h, w), dtype=np.float32)
-            elif blend == "smooth":
-                weight = _distance_weight(h, w)
-            elif blend == "hann":
-                weight = _hann_weight(h, w)
-            else:
-                raise ValueError("blend must be 'average', 'smooth', or 'hann'")
+    if blend not in ("average", "smooth", "hann"):
+        raise ValueError("blend must be 'average', 'smooth', or 'hann'")
 
-            left, top = src.transform * (0, 0)
-            col_off = int(round((left - minx) / pixel_size_x))
-            row_off = int(round((maxy - top) / pixel_size_y))
+    # patch footprints in output pixel coords: (row_off, col_off, height, width)
+    patch_windows = np.zeros((len(patch_files), 4), dtype=np.int64)
+    for i, (left, bottom, right, top) in enumerate(patch_bounds):
+        col_off = int(round((left - minx) / pixel_size_x))
+        row_off = int(round((maxy - top) / pixel_size_y))
+        w = int(round((right - left) / pixel_size_x))
+        h = int(round((top - bottom) / pixel_size_y))
+        patch_windows[i] = (row_off, col_off, h, w)
 
-            acc[row_off:row_off+h, col_off:col_off+w] += data * weight
-            weight_sum[row_off:row_off+h, col_off:col_off+w] += weight
+    # patches already on the output grid are read directly, the rest are warped
+    patch_aligned = np.zeros(len(patch_files), dtype=bool)
+    for i, ((patch_crs, patch_tf, _), bounds) in enumerate(zip(patch_meta, patch_bounds)):
+        col = (bounds[0] - minx) / pixel_size_x
+        row = (maxy - bounds[3]) / pixel_size_y
+        patch_aligned[i] = (
+            patch_crs == crs
+            and patch_tf.b == 0 and patch_tf.d == 0
+            and np.isclose(patch_tf.a, pixel_size_x)
+            and np.isclose(-patch_tf.e, pixel_size_y)
+            and abs(col - round(col)) < 1e-3
+            and abs(row - round(row)) < 1e-3
+        )
 
-    # combine patches
-    result = np.divide(acc, weight_sum, out=np.zeros_like(acc), where=(weight_sum > 0))
+    # warped patches ignore their nodata so real 0 probabilities still count;
+    # coverage comes from the alpha band instead
+    vrt_options = {
+        'crs': crs,
+        'transform': transform,
+        'width': width,
+        'height': height,
+        'resampling': Resampling.bilinear,
+        'src_nodata': None,
+        'nodata': None,
+        'add_alpha': True,
+    }
 
-    # optional mask
+    # optional mask, reprojected per output block
     if mask_file:
         print(f"Applying mask: {mask_file}")
-        with rasterio.open(mask_file) as mask_src:
-            mask_data = np.zeros((height, width), dtype=np.uint8)
-            reproject(
-                source=rasterio.band(mask_src, 1),
-                destination=mask_data,
-                src_transform=mask_src.transform,
-                src_crs=mask_src.crs,
-                dst_transform=transform,
-                dst_crs=crs,
-                resampling=Resampling.nearest,
-            )
-        result *= (mask_data == 1)  # keep only where mask==1
-
-    # convert dtype
-    if dtype == "uint16":
-        result = np.clip(result, 0, 65535).astype(np.uint16)
-    elif dtype == "uint8":
-        result = np.clip(result, 0, 255).astype(np.uint8)
 
-    # save output
+    # save output block by block
     meta = {
         'driver': 'GTiff',
         'height': height,
@@ -147,10 +275,56 @@ def blend_patches_to_raster(
         'compress': 'lzw',
         'photometric': 'minisblack',
         'nodata': 0,
+        'tiled': True,
+        'blockxsize': 512,
+        'blockysize': 512,
+        'bigtiff': 'IF_SAFER',
+        'num_threads': 'ALL_CPUS',
     }
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with rasterio.open(output_path, 'w', **meta) as dst:
-        dst.write(result, 1)
+
+    # each task opens its own patch/mask handles, only this thread touches dst;
+    # rasterio environments are thread-local, so every task enters its own
+    def blend_block(win):
+        with rasterio.Env(**_GDAL_ENV):
+            result = _blend_block(
+                win, patch_files, patch_windows, patch_aligned, blend, vrt_options
+            )
+            if mask_file:
+                block_mask = _mask_block(win, mask_file, transform, crs)
+                np.multiply(result, block_mask == 1, out=result)  # keep only where mask==1
+
+        # convert dtype
+        if dtype == "uint16":
+            result = np.clip(result, 0, 65535, out=result).astype(np.uint16)
+        elif dtype == "uint8":
+            result = np.clip(result, 0, 255, out=result).astype(np.uint8)
+        return result
+
+    with rasterio.Env(GDAL_NUM_THREADS='ALL_CPUS', **_GDAL_ENV), \
+            rasterio.open(output_path, 'w', **meta) as dst, \
+            ThreadPoolExecutor(max_workers=n_workers) as pool:
+        windows = [win for _, win in dst.block_windows(1)]
+        todo = iter(windows)
+
+        # submit at most 2*n_workers blocks ahead of the writer, so finished
+        # blocks waiting to be written stay bounded
+        pending = deque()
+        for win in islice(todo, 2 * n_workers):
+            pending.append((win, pool.submit(blend_block, win)))
+
+        with tqdm(total=len(windows), desc=f"Blending ({blend})") as pbar:
+            while pending:
+                win, future = pending.popleft()
+                dst.write(future.result(), 1, window=win)
+                pbar.update(1)
+                next_win = next(todo, None)
+                if next_win is not None:
+                    pending.append((next_win, pool.submit(blend_block, next_win)))
+
+        # overviews for fast downstream reads
+        dst.build_overviews([2, 4, 8, 16], Resampling.average)
+        dst.update_tags(ns='rio_overview', resampling='average')
 
     print(f"Blended raster saved: {output_path}")
\ No newline at end of file
@@ -1,7 +1,9 @@
 # define gdal polygonization function
 import os
 import glob
+import tempfile
 import numpy as np
+from multiprocessing import Pool
 from osgeo import gdal, ogr, osr
 
 # Threshold
@@ -9,11 +11,95 @@ threshold = 500
 raster_folder = "/landscape_elements/working/postprocessing/mosaic/tile_masked_sieved"
 output_gpkg = "/landscape_elements/working/postprocessing/polygonize/predicted_output.gpkg"
 
+# GeoPackage write settings: fewer fsyncs, journal kept in memory
+gpkg_config = {
+    "OGR_SQLITE_SYNCHRONOUS": "OFF",
+    "OGR_SQLITE_JOURNAL": "MEMORY",
+    "OGR_GPKG_FOREIGN_KEY_CHECK": "NO",
+}
+
+# GDAL is not thread-safe, so each raster runs in its own worker process
+def _init_worker():
+    gdal.SetConfigOption("GDAL_CACHEMAX", "512")
+    for key, value in gpkg_config.items():
+        gdal.SetConfigOption(key, value)
+
+
+def _polygonize_one(args):
+    """
+    Polygonize one raster into its own GeoPackage.
+    Returns the GeoPackage path, or None if the raster was skipped.
+    """
+    raster_path, part_gpkg, threshold = args
+
+    src_ds = gdal.Open(raster_path)
+    if src_ds is None:
+        print(f"Skipping unreadable file: {raster_path}")
+        return None
+
+    src_band = src_ds.GetRasterBand(1)
+    arr = src_band.ReadAsArray()
+    if arr is None:
+        print(f"Empty or invalid raster: {raster_path}")
+        return None
+
+    # Apply threshold directly into the uint8 mask buffer
+    mask_buf = np.empty(arr.shape, dtype=np.uint8)
+    np.greater_equal(arr, threshold, out=mask_buf)
+
+    # Create in-memory raster for mask
+    mem_driver = gdal.GetDriverByName("MEM")
+    mask_ds = mem_driver.Create("", src_ds.RasterXSize, src_ds.RasterYSize, 1, gdal.GDT_Byte)
+    mask_ds.SetGeoTransform(src_ds.GetGeoTransform())
+    mask_ds.SetProjection(src_ds.GetProjection())
+    mask_ds.GetRasterBand(1).WriteArray(mask_buf)
+
+    # Get CRS
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(src_ds.GetProjection())
+
+    # Create in-memory vector layer, written to GeoPackage in one go below
+    mem_ds = gdal.GetDriverByName("Memory").Create("", 0, 0, 0, gdal.GDT_Unknown)
+    mem_layer = mem_ds.CreateLayer("polygons", srs=srs, geom_type=ogr.wkbPolygon)
+    mem_layer.CreateField(ogr.FieldDefn("value", ogr.OFTInteger))
+
+    # Polygonize; the mask band itself is the mask, so 0 pixels are skipped
+    tmp_layer_name = os.path.splitext(os.path.basename(raster_path))[0]
+    gdal.Polygonize(
+        mask_ds.GetRasterBand(1),
+        mask_ds.GetRasterBand(1),
+        mem_layer,
+        0,  # field index for "value"
+        [],
+        callback=None
+    )
+
+    # Bulk-copy to the per-raster GeoPackage (batched transactions),
+    # filling the "source" field with the raster name on the way
+    source = tmp_layer_name.replace("'", "''")
+    gdal.VectorTranslate(
+        part_gpkg,
+        mem_ds,
+        format="GPKG",
+        layerName="polygons",
+        geometryType="POLYGON",
+        SQLStatement=f"SELECT GEOMETRY, '{source}' AS source FROM polygons",
+        SQLDialect="SQLite",
+    )
+
+    # Cleanup
+    src_ds = None
+    mask_ds = None
+    mem_ds = None
+    return part_gpkg
+
+
 # define function
 def raster_to_polygons_gdal(
     raster_folder,
     output_gpkg,
-    threshold=500
+    threshold=500,
+    n_workers=None
 ):
     """
     Polygonizes all rasters in a folder to a single GeoPackage,
@@ -27,6 +113,8 @@ def raster_to_polygons_gdal(
         Path to output GeoPackage.
     threshold : int or float, optional
         Threshold for binary mask (default=500).
+    n_workers : int, optional
+        Number of worker processes (default: all CPUs).
     """
 
 
@@ -39,70 +127,42 @@ def raster_to_polygons_gdal(
     driver = ogr.GetDriverByName("GPKG")
     if os.path.exists(output_gpkg):
         driver.DeleteDataSource(output_gpkg)
-    out_ds = driver.CreateDataSource(output_gpkg)
-
-    out_layer = None  # will create first time inside loop
-
-    for i, raster_path in enumerate(raster_files, 1):
-        print(f"[{i}/{len(raster_files)}] Processing {raster_path}...")
-
-        src_ds = gdal.Open(raster_path)
-        if src_ds is None:
-            print(f"Skipping unreadable file: {raster_path}")
-            continue
-
-        src_band = src_ds.GetRasterBand(1)
-        arr = src_band.ReadAsArray()
-        if arr is None:
-            print(f"Empty or invalid raster: {raster_path}")
-            continue
-
-        # Apply threshold
-        mask = (arr >= threshold).astype(np.uint8)
-
-        # Create in-memory raster for mask
-        mem_driver = gdal.GetDriverByName("MEM")
-        mask_ds = mem_driver.Create("", src_ds.RasterXSize, src_ds.RasterYSize, 1, gdal.GDT_Byte)
-        mask_ds.SetGeoTransform(src_ds.GetGeoTransform())
-        mask_ds.SetProjection(src_ds.GetProjection())
-        mask_ds.GetRasterBand(1).WriteArray(mask)
-
-        # Get CRS
-        srs = osr.SpatialReference()
-        srs.ImportFromWkt(src_ds.GetProjection())
-
-        # Create layer if not created yet
-        if out_layer is None:
-            out_layer = out_ds.CreateLayer("polygons", srs=srs, geom_type=ogr.wkbPolygon)
-            #out_layer.CreateField(ogr.FieldDefn("value", ogr.OFTInteger))
-            out_layer.CreateField(ogr.FieldDefn("source", ogr.OFTString))
-
-        # Polygonize
-        tmp_layer_name = os.path.splitext(os.path.basename(raster_path))[0]
-        gdal.Polygonize(
-            mask_ds.GetRasterBand(1),
-            mask_ds.GetRasterBand(1),
-            out_layer,
-            0,  # field index for "value"
-            [],
-            callback=None
-        )
-
-        # Update the "source" field with raster name
-        for feature in out_layer:
-            feature.SetField("source", tmp_layer_name)
-            out_layer.SetFeature(feature)
-
-        # Cleanup
-        src_ds = None
-        mask_ds = None
-
-    out_ds = None  # flush to disk
+
+    n_written = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_gpkg) or None) as tmp_dir:
+        tasks = [
+            (raster_path, os.path.join(tmp_dir, f"part_{i}.gpkg"), threshold)
+            for i, raster_path in enumerate(raster_files)
+        ]
+
+        # Polygonize in parallel, merge the per-raster layers in order
+        with Pool(n_workers or os.cpu_count(), initializer=_init_worker) as pool:
+            for i, part_gpkg in enumerate(pool.imap(_polygonize_one, tasks), 1):
+                print(f"[{i}/{len(raster_files)}] Processed {raster_files[i - 1]}")
+                if part_gpkg is None:
+                    continue
+
+                with gdal.config_options(gpkg_config):
+                    gdal.VectorTranslate(
+                        output_gpkg,
+                        part_gpkg,
+                        format="GPKG",
+                        layerName="polygons",
+                        accessMode="append" if os.path.exists(output_gpkg) else None,
+                    )
+                os.remove(part_gpkg)
+                n_written += 1
+
+    if n_written == 0:
+        print(f"No rasters could be polygonized, {output_gpkg} was not created")
+        return
+
     print(f"All rasters processed and saved to {output_gpkg}")
 
 # apply function
-raster_to_polygons_gdal(
-    raster_folder=raster_folder,
-    output_gpkg=output_gpkg,
-    threshold=threshold
-)
\ No newline at end of file
+if __name__ == "__main__":
+    raster_to_polygons_gdal(
+        raster_folder=raster_folder,
+        output_gpkg=output_gpkg,
+        threshold=threshold
+    )
@@ -2,6 +2,7 @@ import os
 from osgeo import gdal
 import numpy as np
 from glob import glob
+from multiprocessing import Pool
 
 # --- Parameters ---
 resolution = 1  # meters
@@ -31,22 +32,22 @@ def gdal_sieve(input_path, output_path, threshold=64, connectivity=4, prob_thres
     src_mem.SetProjection(src_ds.GetProjection())
     src_mem.GetRasterBand(1).WriteArray(binary)
 
-    # Prepare output dataset
-    out_driver = gdal.GetDriverByName("GTiff")
-    out_ds = out_driver.Create(
-        output_path,
-        src_ds.RasterXSize,
-        src_ds.RasterYSize,
-        1,
-        gdal.GDT_Byte,
-        options=["COMPRESS=LZW", "TILED=YES"]
-    )
-    out_ds.SetGeoTransform(src_ds.GetGeoTransform())
-    out_ds.SetProjection(src_ds.GetProjection())
+    # Sieve into an in-memory working copy, kept for masking below
+    out_mem = driver.Create("", src_ds.RasterXSize, src_ds.RasterYSize, 1, gdal.GDT_Byte)
+    out_mem.SetGeoTransform(src_ds.GetGeoTransform())
+    out_mem.SetProjection(src_ds.GetProjection())
 
     # Apply sieve filter
-    gdal.SieveFilter(src_mem.GetRasterBand(1), None, out_ds.GetRasterBand(1), threshold, connectivity)
-    out_ds.GetRasterBand(1).SetNoDataValue(0)
+    gdal.SieveFilter(src_mem.GetRasterBand(1), None, out_mem.GetRasterBand(1), threshold, connectivity)
+    out_mem.GetRasterBand(1).SetNoDataValue(0)
+
+    # Write sieved mask to disk
+    out_ds = gdal.Translate(
+        output_path,
+        out_mem,
+        format="GTiff",
+        creationOptions=["COMPRESS=LZW", "TILED=YES"]
+    )
     out_ds.FlushCache()
 
     print(f"Sieved mask saved to: {output_path}")
@@ -56,10 +57,12 @@ def gdal_sieve(input_path, output_path, threshold=64, connectivity=4, prob_thres
         if masked_output_path is None:
             masked_output_path = output_path.replace(".tif", "_masked.tif")
 
-        sieved_mask = out_ds.GetRasterBand(1).ReadAsArray().astype(bool)
-        masked_prob = np.where(sieved_mask, arr, 0).astype(np.uint16)
+        # Zero removed pixels in place (no copy if arr is already uint16)
+        sieved_mask = out_mem.GetRasterBand(1).ReadAsArray()
+        masked_prob = arr.astype(np.uint16, copy=False)
+        masked_prob[sieved_mask == 0] = 0
 
-        masked_ds = out_driver.Create(
+        masked_ds = gdal.GetDriverByName("GTiff").Create(
             masked_output_path,
             src_ds.RasterXSize,
             src_ds.RasterYSize,
@@ -79,19 +82,22 @@ def gdal_sieve(input_path, output_path, threshold=64, connectivity=4, prob_thres
 
     src_ds = None
     src_mem = None
+    out_mem = None
     out_ds = None
 
 
 # --- Batch mode ---
 input_dir = "/postprocessing/mosaic/tile_masked"
 output_dir = "/postprocessing/mosaic/tile_masked_sieved"
-os.makedirs(output_dir, exist_ok=True)
+n_workers = os.cpu_count()  # each worker holds a whole tile in memory; lower for large tiles
+
 
-tifs = sorted(glob(os.path.join(input_dir, "*.tif")))
+def _init_worker():
+    # GDAL is process-safe but not thread-safe; one raster per worker process
+    gdal.SetConfigOption("GDAL_CACHEMAX", "512")
 
-print(f"Found {len(tifs)} input rasters to process.\n")
 
-for tif in tifs:
+def _sieve_one(tif):
     fname = os.path.basename(tif)
     out_mask = os.path.join(output_dir, fname.replace(".tif", "_mask.tif"))
     out_prob = os.path.join(output_dir, fname.replace(".tif", "_masked_prob.tif"))
@@ -104,3 +110,14 @@ for tif in tifs:
         apply_mask=True,
         masked_output_path=out_prob
     )
+
+
+if __name__ == "__main__":
+    os.makedirs(output_dir, exist_ok=True)
+
+    tifs = sorted(glob(os.path.join(input_dir, "*.tif")))
+
+    print(f"Found {len(tifs)} input rasters to process.\n")
+
+    with Pool(n_workers, initializer=_init_worker) as pool:
+        pool.map(_sieve_one, tifs)
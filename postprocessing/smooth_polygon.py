@@ -1,8 +1,15 @@
 import os
 import geopandas as gpd
+import pyogrio
+import numpy as np
 from shapely.ops import unary_union
-from shapely.geometry import MultiPolygon
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from shapelysmooth import taubin_smooth
+from joblib import Parallel, delayed
+
+# faster GPKG writes: output files are regenerated on failure anyway
+pyogrio.set_gdal_config_options({"OGR_SQLITE_SYNCHRONOUS": "OFF"})
 
 # smooth with buffer
 def smooth_shapely(
@@ -23,46 +30,90 @@ def smooth_shapely(
 
     print(f"Smoothing (QGIS-style buffer): {os.path.basename(input_file)}")
 
-    gdf = gpd.read_file(input_file)
-    geom_union = unary_union(gdf.geometry)
+    gdf = gpd.read_file(input_file, engine="pyogrio")
+    geoms = gdf.geometry
 
     # Simplify before buffer
     if simplify_tolerance_pre is not None:
-        geom_union = geom_union.simplify(
+        geoms = geoms.simplify(
             simplify_tolerance_pre, preserve_topology=preserve_topology
         )
 
-    # Apply buffer-based smoothing
-    smoothed = geom_union.buffer(
-        smooth_distance,
-        resolution=segments,
-        cap_style=cap_style,
-        join_style=join_style,
-        mitre_limit=mitre_limit,
-    ).buffer(
-        -smooth_distance-0.5,
+    buffer_kwargs = dict(
         resolution=segments,
         cap_style=cap_style,
         join_style=join_style,
         mitre_limit=mitre_limit,
     )
 
+    # Apply buffer-based smoothing, per geometry
+    grown = geoms.buffer(smooth_distance, **buffer_kwargs)
+
+    # Merge grown polygons only within groups that actually overlap
+    left, right = grown.sindex.query(grown, predicate="intersects")
+    n = len(grown)
+    graph = coo_matrix((np.ones(len(left), dtype=bool), (left, right)), shape=(n, n))
+    n_groups, labels = connected_components(graph, directed=False)
+    single = np.bincount(labels, minlength=n_groups)[labels] == 1
+
+    if not single.all():
+        # indices of grouped polygons, sorted so each group is contiguous
+        idx = np.nonzero(~single)[0]
+        idx = idx[np.argsort(labels[idx], kind="stable")]
+        groups = np.split(idx, np.flatnonzero(np.diff(labels[idx])) + 1)
+        merged = [unary_union(grown.values[g]) for g in groups]
+        grown = gpd.GeoSeries(
+            list(grown.values[single]) + merged, crs=gdf.crs
+        ).explode(index_parts=False)
+
+    smoothed = grown.buffer(-smooth_distance-0.5, **buffer_kwargs)
+
     # Simplify after buffer (optional)
     if simplify_tolerance_post is not None:
         smoothed = smoothed.simplify(
             simplify_tolerance_post, preserve_topology=preserve_topology
         )
 
-    # Build output GeoDataFrame
-    if isinstance(smoothed, MultiPolygon):
-        out_gdf = gpd.GeoDataFrame(geometry=list(smoothed.geoms), crs=gdf.crs)
-    else:
-        out_gdf = gpd.GeoDataFrame(geometry=[smoothed], crs=gdf.crs)
+    # Build output GeoDataFrame, one feature per polygon
+    smoothed = smoothed[~smoothed.is_empty].explode(index_parts=False)
+    out_gdf = gpd.GeoDataFrame(geometry=smoothed.values, crs=gdf.crs)
 
-    out_gdf.to_file(output_file, driver="GPKG")
+    out_gdf.to_file(output_file, driver="GPKG", engine="pyogrio")
     print(f"Saved smoothed polygons to {output_file}")
     return out_gdf
 
+# smooth one geometry with Taubin
+def _taubin_one(
+    geom,
+    factor,
+    mu,
+    steps,
+    simplify_tolerance_pre,
+    simplify_tolerance_post,
+    preserve_topology
+):
+    try:
+        # Simplify first
+        if simplify_tolerance_pre is not None:
+            geom = geom.simplify(
+                simplify_tolerance_pre, preserve_topology=preserve_topology
+            )
+
+        # Apply Taubin smoothing
+        smoothed_geom = taubin_smooth(geom, factor=factor, mu=mu, steps=steps)
+
+        # Simplify again after smoothing
+        if simplify_tolerance_post is not None:
+            smoothed_geom = smoothed_geom.simplify(
+                simplify_tolerance_post, preserve_topology=preserve_topology
+            )
+
+        return smoothed_geom
+
+    except Exception as e:
+        print(f"Taubin smoothing failed on geometry: {e}")
+        return geom
+
 # smooth with Taubin
 def smooth_taubin(
     input_file,
@@ -72,40 +123,31 @@ def smooth_taubin(
     steps=3,
     simplify_tolerance_pre=None,
     simplify_tolerance_post=0.1,
-    preserve_topology=True
+    preserve_topology=True,
+    n_jobs=-1
 ):
     """
     Pipeline: simplify first → Taubin smoothing → simplify again.
+    Geometries are smoothed in parallel threads (n_jobs, joblib convention).
     """
-    gdf = gpd.read_file(input_file)
-    smoothed = []
-
-    for geom in gdf.geometry:
-        try:
-            # Simplify first
-            if simplify_tolerance_pre is not None:
-                geom = geom.simplify(
-                    simplify_tolerance_pre, preserve_topology=preserve_topology
-                )
-
-            # Apply Taubin smoothing
-            smoothed_geom = taubin_smooth(geom, factor=factor, mu=mu, steps=steps)
-
-            # Simplify again after smoothing
-            if simplify_tolerance_post is not None:
-                smoothed_geom = smoothed_geom.simplify(
-                    simplify_tolerance_post, preserve_topology=preserve_topology
-                )
-
-            smoothed.append(smoothed_geom)
-
-        except Exception as e:
-            print(f"Taubin smoothing failed on geometry: {e}")
-            smoothed.append(geom)
+    gdf = gpd.read_file(input_file, engine="pyogrio")
+
+    smoothed = Parallel(n_jobs=n_jobs, prefer="threads", batch_size=256)(
+        delayed(_taubin_one)(
+            geom,
+            factor,
+            mu,
+            steps,
+            simplify_tolerance_pre,
+            simplify_tolerance_post,
+            preserve_topology,
+        )
+        for geom in gdf.geometry
+    )
 
     # Build output GeoDataFrame
     out_gdf = gpd.GeoDataFrame(geometry=smoothed, crs=gdf.crs)
-    out_gdf.to_file(output_file, driver="GPKG")
+    out_gdf.to_file(output_file, driver="GPKG", engine="pyogrio")
 
     return out_gdf
 